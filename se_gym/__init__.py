@@ -1,5 +1,12 @@
 from .sampler import Sampler
-from .runner import apply_patch, apply_patch_and_test, MalformedPatchException
+from .runner import (
+    apply_patch,
+    apply_patch_and_test,
+    evaluate_population,
+    MalformedPatchException,
+    MissingTestResultsException,
+    TestTimeoutException,
+)
 from .fitness import percent_successfull, num_failed_tests
 from .api import make
 from . import observe
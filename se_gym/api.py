@@ -74,6 +74,8 @@ class Environment:
             self.dataset["environment_setup_commit"][self.current_index],
         )
         self.current_issue = self.dataset["problem_statement"][self.current_index]
+        # start the containers while the first patches are generated
+        runner.ContainerPool.get_instance(self.current_path).warm_up()
         return State(path=self.current_path, issue=self.current_issue)
 
     def _check_valid_patch(self, patch: str): ...
@@ -83,7 +85,17 @@ class Environment:
         Perform an action in the environment.
         """
         if isinstance(action, list):
-            return [self.step(a) for a in action]
+            trees = runner.evaluate_population(
+                code_base_root=self.current_path, patches=action
+            )
+            return [
+                State(
+                    path=self.current_path,
+                    issue=self.current_issue,
+                    logs=None if tree is None else runner.parse_pytest_xml(tree),
+                )
+                for tree in trees
+            ]
         tree = runner.apply_patch_and_test(
             code_base_root=self.current_path, patch=action
         )
@@ -0,0 +1,64 @@
+"""
+This module contains a persistent cache for test results, so that patches which were already evaluated on a codebase do not have to be run again.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import typing
+
+from . import config
+
+
+class ResultCache:
+    """
+    ResultCache is a key-value store in a sqlite database. It can be shared between threads.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT)"
+            )
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """
+        Hash all parts, together with config.CACHE_VERSION, into a key.
+        """
+        key = hashlib.sha1(str(config.CACHE_VERSION).encode())
+        for part in parts:
+            key.update(b"\0" + part.encode())
+        return key.hexdigest()
+
+    def get(self, key: str) -> typing.Optional[str]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key: str, value: str):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)",
+                (key, value),
+            )
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM results")
+
+    instance = None
+
+    @staticmethod
+    def get_instance():
+        if ResultCache.instance is None:
+            ResultCache.instance = ResultCache(
+                os.path.join(config.CACHE_DIR, "test_results.sqlite3")
+            )
+        return ResultCache.instance
@@ -2,8 +2,27 @@ MAX_RETRIES = 5
 TIMEOUT_SECONDS = 60
 DEFAULT_SAVE_PATH = "./temp"
 DOCKER_TAG = "pytest-env"
-GIT_APPLY_PATCH = "git apply --ignore-space-change --ignore-whitespace --verbose --recount --inaccurate-eof ./file.patch"
-GIT_CHECK_PATCH = "git apply --check --ignore-space-change --ignore-whitespace --verbose --recount --inaccurate-eof ./file.patch"
+GIT_APPLY_PATCH = "git apply --ignore-space-change --ignore-whitespace --verbose --recount --inaccurate-eof -"
+GIT_CHECK_PATCH = "git apply --check --ignore-space-change --ignore-whitespace --verbose --recount --inaccurate-eof -"
 GIT_DISCARD_CHANGES = "git reset --hard HEAD"
 GIT_DIFF = "git diff"
 MODEL_NAME = "llama3:8b"
+MAX_CONCURRENCY = 8
+FITNESS_CACHE_SIZE = 1024
+MAX_CONTEXT_TOKENS = 8192
+CONTAINER_POOL_SIZE = 4
+GIT_SNAPSHOT = "sh -c 'git config --global --add safe.directory /repo && git init -q && git add -A -f && git -c user.name=se_gym -c user.email=se_gym@localhost commit -q --no-verify --allow-empty -m se_gym_snapshot'"
+GIT_RESET_SNAPSHOT = "sh -c 'git reset -q --hard && git clean -q -fdx'"
+GIT_HEAD = ["git", "rev-parse", "HEAD"]
+GIT_DIFF_HEAD = ["git", "diff", "HEAD", "--binary"]
+GIT_UNTRACKED = ["git", "ls-files", "--others", "--exclude-standard", "-z"]
+TEST_TIMEOUT_SECONDS = 600
+PYTEST_COMMAND = "pytest -q --no-header --junitxml=/results/testresults.xml"
+PYTEST_CACHE_DIR = "/tmp/pytest_cache"
+CACHE_TEST_RESULTS = True
+CACHE_DIR = "./temp/cache"
+CACHE_VERSION = 2
+COPY_CODEBASE = "sh -c 'tar -C /repo-src --exclude=.git -cf - . | tar -C /repo -xf -'"
+COPY_FILES = "sh -c 'cd /repo-src && cp -a --parents -- \"$@\" /repo/' sh"
+TMPFS_OPTIONS = "rw,exec"
+CONTAINER_ENVIRONMENT = {"PYTHONDONTWRITEBYTECODE": "1"}
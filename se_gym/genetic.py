@@ -2,13 +2,20 @@
 This module contains a possible genetic algorithm implementation for LLM prompt optimization, compatible with PyGAD.
 """
 
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import threading
 import typing
 import openai
 import pydantic
 import instructor
+import tenacity
 import random
 import logging
 from . import config
+from . import utils
 
 __dict__ = ["Population", "LLMPopulation"]
 
@@ -32,12 +39,26 @@ class Child(pydantic.BaseModel):
     )
 
 
+class CrossoverBatch(pydantic.BaseModel):
+    pairs: typing.List[Children] = pydantic.Field(
+        description="One pair of child prompts for every pair of parent prompts, in the same order as the parent pairs."
+    )
+
+
+class MutationBatch(pydantic.BaseModel):
+    children: typing.List[Child] = pydantic.Field(
+        description="One child prompt for every parent prompt, in the same order as the parents."
+    )
+
+
+# The system prompts are constant, fitness scores only go into the user prompts.
+# This keeps the message prefix identical across requests, so it can be served from the provider's prompt cache.
 CROSSOVER_SYSTEM_PROMPT = """
 You are a prompt engineer. 
 You are trying to improve the quality of two prompts (instructions) using a genetic algorithm by performing a crossover operation.
 During the crossover operation, you combine two prompts to create two new prompts.
 You are trying to maximize the fitness of the new prompts. 
-The two parent prompts performed well in the previous generation, receiving fitness scores of {fitness1} and {fitness2} respectively.
+The two parent prompts performed well in the previous generation, their fitness scores are given with the prompts.
 To increase the fitness of the child prompts, extract the best parts of the two parent prompts and combine them in a way that improves the overall quality. 
 You know that the child prompts should be similar to the parent prompts, but not identical. 
 You also know that the child prompts should be different from each other.
@@ -64,7 +85,7 @@ You are a prompt engineer.
 You are trying to improve the quality of a prompt (instructions) using a genetic algorithm by performing a mutation operation.
 During the mutation operation, you modify the prompt to create a new prompt.
 You are trying to maximize the fitness of the new prompt.
-The parent prompt performed not so well in the previous generation, receiving a fitness score of {fitness}.
+The parent prompt performed not so well in the previous generation, its fitness score is given with the prompt.
 To increase the fitness of the child prompt, make major changes to the parent prompt that improve the overall quality.
 You know that the child prompt should be similar to the parent prompt, but not identical.
 You know the fitness score of the parent prompt and how it is calculated.
@@ -79,6 +100,62 @@ The parent prompt with a fitness score of {fitness} is:
 Based on the parent prompt, create a new prompt that is similar to the parent prompt but not identical.
 """
 
+CROSSOVER_BATCH_SYSTEM_PROMPT = """
+You are a prompt engineer.
+You are trying to improve the quality of prompts (instructions) using a genetic algorithm by performing crossover operations.
+You are given several numbered pairs of parent prompts. For every pair, you combine the two prompts to create two new prompts.
+You are trying to maximize the fitness of the new prompts.
+The parent prompts performed well in the previous generation, each pair lists the fitness scores of its parents.
+To increase the fitness of the child prompts, extract the best parts of the two parent prompts of a pair and combine them in a way that improves the overall quality.
+You know that the child prompts should be similar to their parent prompts, but not identical.
+You also know that the two child prompts of a pair should be different from each other.
+You create exactly one pair of child prompts for every pair of parent prompts, in the same order.
+You always output in JSON format.
+"""
+
+CROSSOVER_BATCH_PAIR_PROMPT = """
+Pair {index}:
+The first prompt with a fitness score of {fitness1} is:
+=======================================================
+{parent1}
+=======================================================
+
+The second prompt with a fitness score of {fitness2} is:
+=======================================================
+{parent2}
+=======================================================
+"""
+
+CROSSOVER_BATCH_USER_PROMPT = """
+{pairs}
+Based on each of the {num_pairs} pairs of parent prompts, create two new prompts that are similar to the parent prompts but not identical.
+"""
+
+MUTATION_BATCH_SYSTEM_PROMPT = """
+You are a prompt engineer.
+You are trying to improve the quality of prompts (instructions) using a genetic algorithm by performing mutation operations.
+You are given several numbered parent prompts. For every parent, you modify the prompt to create a new prompt.
+You are trying to maximize the fitness of the new prompts.
+The parent prompts performed not so well in the previous generation, each parent lists its fitness score.
+To increase the fitness of the child prompts, make major changes to the parent prompts that improve the overall quality.
+You know that the child prompts should be similar to their parent prompt, but not identical.
+You create exactly one child prompt for every parent prompt, in the same order.
+You always output in JSON format.
+"""
+
+MUTATION_BATCH_PARENT_PROMPT = """
+Parent {index}:
+The parent prompt with a fitness score of {fitness} is:
+=======================================================
+{parent}
+=======================================================
+"""
+
+MUTATION_BATCH_USER_PROMPT = """
+{parents}
+Based on each of the {num_parents} parent prompts, create a new prompt that is similar to the parent prompt but not identical.
+"""
+
 
 def get_messages(system_prompt, user_prompt):
     return [
@@ -87,46 +164,169 @@ def get_messages(system_prompt, user_prompt):
     ]
 
 
+def estimate_tokens(messages) -> int:
+    """
+    Roughly estimate the number of tokens in a list of messages (about 4 characters per token).
+    """
+    return sum(len(m["content"]) for m in messages) // 4
+
+
+def get_async_client(
+    client: typing.Union[openai.Client, openai.AsyncClient]
+) -> openai.AsyncClient:
+    """
+    Return an async counterpart of an OpenAI client, so that multiple requests can be in flight at once.
+    """
+    if isinstance(client, openai.AsyncClient):
+        return client
+    return openai.AsyncClient(
+        api_key=client.api_key,
+        organization=client.organization,
+        base_url=client.base_url,
+        timeout=client.timeout,
+        max_retries=client.max_retries,
+        default_headers=client._custom_headers,
+        default_query=client._custom_query,
+    )
+
+
+def _is_transient_error(e: BaseException) -> bool:
+    """
+    Whether the error, or an error it was raised from (e.g. inside instructor's retries), is a rate limit or timeout error.
+    """
+    while e is not None:
+        if isinstance(e, (openai.RateLimitError, openai.APITimeoutError)):
+            return True
+        e = e.__cause__ or e.__context__
+    return False
+
+
+def _transient_retry_args() -> dict:
+    """
+    Arguments for tenacity to retry rate limit errors and timeouts with random exponential backoff.
+    """
+    return dict(
+        retry=tenacity.retry_if_exception(_is_transient_error),
+        wait=tenacity.wait_random_exponential(min=1, max=30),
+        stop=tenacity.stop_after_attempt(config.MAX_RETRIES),
+        reraise=True,
+    )
+
+
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+
+def get_shared_client(
+    client: typing.Union[openai.Client, openai.AsyncClient, None] = None,
+) -> openai.AsyncClient:
+    """
+    Return the instructor-patched async client for `client`, creating it on first use.
+    All populations using the same client share one patched client and its connection pool, instead of patching (and wrapping) it again for every population.
+    If `client` is None, a client configured from the OPENAI_* environment variables is used.
+    """
+    with _shared_clients_lock:
+        if client not in _shared_clients:
+            async_client = (
+                openai.AsyncClient() if client is None else get_async_client(client)
+            )
+            _shared_clients[client] = instructor.patch(
+                async_client, mode=instructor.Mode.JSON
+            )
+        return _shared_clients[client]
+
+
 class Population:
     def __init__(
         self,
-        client: openai.Client,
+        client: typing.Union[openai.Client, openai.AsyncClient, None],
         initial_individuals: typing.List[prompt],
         sampler,
         elite_size: int = 1,
         mutation_rate: float = 0.2,
         crossover_rate: float = 0.7,
+        rpm: typing.Optional[int] = None,
+        tpm: typing.Optional[int] = None,
+        max_concurrency: int = config.MAX_CONCURRENCY,
     ):
-        self.client = instructor.patch(client, mode=instructor.Mode.JSON)
+        """
+        Args:
+            rpm: Maximum number of LLM requests per minute, None for no limit.
+            tpm: Maximum number of (estimated) prompt tokens per minute, None for no limit.
+            max_concurrency: Maximum number of LLM requests in flight at the same time.
+        """
+        self.client = get_shared_client(client)
         self.individuals = initial_individuals
         self.sampler = sampler
         self.elite_size = elite_size
         self.mutation_probability = mutation_rate
         self.crossover_probability = crossover_rate
+        # LRU cache of sha1(individual, observation) -> [action, fitness]
+        self._fitness_cache: typing.OrderedDict[str, list] = collections.OrderedDict()
+        self._last_observation = None
+        self._request_limiter = utils.AsyncRateLimiter(rpm, 60) if rpm else None
+        self._token_limiter = utils.AsyncRateLimiter(tpm, 60) if tpm else None
+        self.max_concurrency = max_concurrency
+        self._semaphore = None  # created on the event loop
 
-    def _mutate(self, parent: prompt, fitness: float):
+    async def _create(self, messages, response_model):
+        """
+        Send a request to the LLM, respecting the rate limits and the concurrency limit.
+        Rate limit errors and timeouts are retried with random exponential backoff.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async for attempt in tenacity.AsyncRetrying(**_transient_retry_args()):
+            with attempt:
+                await self._acquire(estimate_tokens(messages))
+                async with self._semaphore:
+                    return await self.client.chat.completions.create(
+                        model=config.MODEL_NAME,
+                        messages=messages,
+                        response_model=response_model,
+                        max_retries=1,
+                    )
+
+    async def _acquire(self, tokens: int):
+        """
+        Wait until the rate limits allow another request with `tokens` prompt tokens.
+        """
+        if self._request_limiter is not None:
+            await self._request_limiter.acquire()
+        if self._token_limiter is not None:
+            await self._token_limiter.acquire(tokens)
+
+    def _sample(self, individual: prompt, observation):
+        """
+        Call the sampler, respecting the rate limits. Rate limit errors and timeouts are retried with random exponential backoff.
+        The sampler threads share the limiters with the async requests by acquiring them on the background event loop.
+        """
+        messages = get_messages(individual, str(observation))
+        for attempt in tenacity.Retrying(**_transient_retry_args()):
+            with attempt:
+                utils.run_sync(self._acquire(estimate_tokens(messages)))
+                return self.sampler(system_prompt=individual, context=observation)
+
+    async def _mutate(self, parent: prompt, fitness: float):
         logger.debug(f"Mutating {parent} with fitness {fitness}")
-        resp = self.client.chat.completions.create(
-            model=config.MODEL_NAME,
+        resp = await self._create(
             messages=get_messages(
-                MUTATION_SYSTEM_PROMPT.format(fitness=fitness),
+                MUTATION_SYSTEM_PROMPT,
                 MUTATION_USER_PROMPT.format(fitness=fitness, parent=parent),
             ),
             response_model=Child,
-            max_retries=1,
         )
         return resp
 
-    def _crossover(
+    async def _crossover(
         self, parent1: prompt, parent2: prompt, fitness1: float, fitness2: float
     ):
         logger.debug(
             f"Crossover {parent1} with fitness {fitness1} and {parent2} with fitness {fitness2}"
         )
-        resp = self.client.chat.completions.create(
-            model=config.MODEL_NAME,
+        resp = await self._create(
             messages=get_messages(
-                CROSSOVER_SYSTEM_PROMPT.format(fitness1=fitness1, fitness2=fitness2),
+                CROSSOVER_SYSTEM_PROMPT,
                 CROSSOVER_USER_PROMPT.format(
                     fitness1=fitness1,
                     fitness2=fitness2,
@@ -135,10 +335,63 @@ class Population:
                 ),
             ),
             response_model=Children,
-            max_retries=1,
         )
         return resp
 
+    async def _mutate_batch(self, parents) -> typing.List[Child]:
+        """
+        Mutate all (parent, fitness) tuples with a single request.
+        Falls back to one request per parent if the batch would exceed config.MAX_CONTEXT_TOKENS.
+        """
+        if not parents:
+            return []
+        messages = get_messages(
+            MUTATION_BATCH_SYSTEM_PROMPT,
+            MUTATION_BATCH_USER_PROMPT.format(
+                parents="".join(
+                    MUTATION_BATCH_PARENT_PROMPT.format(
+                        index=i + 1, fitness=fitness, parent=parent
+                    )
+                    for i, (parent, fitness) in enumerate(parents)
+                ),
+                num_parents=len(parents),
+            ),
+        )
+        if len(parents) == 1 or estimate_tokens(messages) > config.MAX_CONTEXT_TOKENS:
+            return await asyncio.gather(*[self._mutate(*p) for p in parents])
+        logger.debug(f"Mutating {len(parents)} parents in one batch")
+        resp = await self._create(messages=messages, response_model=MutationBatch)
+        return resp.children[: len(parents)]
+
+    async def _crossover_batch(self, parents) -> typing.List[Children]:
+        """
+        Cross over all (parent1, parent2, fitness1, fitness2) tuples with a single request.
+        Falls back to one request per pair if the batch would exceed config.MAX_CONTEXT_TOKENS.
+        """
+        if not parents:
+            return []
+        messages = get_messages(
+            CROSSOVER_BATCH_SYSTEM_PROMPT,
+            CROSSOVER_BATCH_USER_PROMPT.format(
+                pairs="".join(
+                    CROSSOVER_BATCH_PAIR_PROMPT.format(
+                        index=i + 1,
+                        fitness1=fitness1,
+                        fitness2=fitness2,
+                        parent1=parent1,
+                        parent2=parent2,
+                    )
+                    for i, (parent1, parent2, fitness1, fitness2) in enumerate(parents)
+                ),
+                num_pairs=len(parents),
+            ),
+        )
+        if len(parents) == 1 or estimate_tokens(messages) > config.MAX_CONTEXT_TOKENS:
+            return await asyncio.gather(*[self._crossover(*p) for p in parents])
+        logger.debug(f"Crossing over {len(parents)} pairs in one batch")
+        resp = await self._create(messages=messages, response_model=CrossoverBatch)
+        return resp.pairs[: len(parents)]
+
     def _selection(
         self,
         fitnesses: typing.List[float],
@@ -150,23 +403,7 @@ class Population:
             zip(self.individuals, fitnesses), key=lambda x: x[1], reverse=True
         )  # Select the best performing individuals
         elite = [x[0] for x in sorted_population[: self.elite_size]]  # select the elite
-        mutated = []  # run mutation on mutation_probability
-        for ind, fit in sorted_population:
-            if ind not in elite and random.random() < self.mutation_probability:
-                mutated.append(self._mutate(ind, fit))
-        crossed = []  # run crossover on crossover_probability
-        for i in range(0, len(sorted_population), 2):
-            if random.random() < self.crossover_probability and i + 1 < len(
-                sorted_population
-            ):
-                crossed.append(
-                    self._crossover(
-                        sorted_population[i][0],
-                        sorted_population[i + 1][0],
-                        sorted_population[i][1],
-                        sorted_population[i + 1][1],
-                    )
-                )
+        mutated, crossed = utils.run_sync(self._breed(sorted_population, elite))
         # create new population by combining elite, mutated and crossed and fill the rest with random individuals
         new_population = (
             elite
@@ -178,23 +415,107 @@ class Population:
             new_population.append(random.choice(self.individuals))
         self.individuals = new_population  # update the population
 
+    async def _breed(self, sorted_population, elite):
+        """
+        Run the batched mutation and crossover requests concurrently.
+        """
+        mut_parents = [  # run mutation on mutation_probability, skipping the elite
+            (ind, fit)
+            for ind, fit in sorted_population[len(elite) :]
+            if random.random() < self.mutation_probability
+        ]
+        cross_parents = [  # run crossover on crossover_probability
+            (
+                sorted_population[i][0],
+                sorted_population[i + 1][0],
+                sorted_population[i][1],
+                sorted_population[i + 1][1],
+            )
+            for i in range(0, len(sorted_population), 2)
+            if random.random() < self.crossover_probability
+            and i + 1 < len(sorted_population)
+        ]
+        return await asyncio.gather(
+            self._mutate_batch(mut_parents),
+            self._crossover_batch(cross_parents),
+        )
+
+    @staticmethod
+    def _cache_key(individual: prompt, observation) -> str:
+        return hashlib.sha1(f"{individual}\0{observation}".encode()).hexdigest()
+
+    def _cache_get(self, key: str):
+        entry = self._fitness_cache.get(key)
+        if entry is not None:
+            self._fitness_cache.move_to_end(key)
+        return entry
+
+    def _cache_set(self, key: str, action=None, fitness=None):
+        entry = self._fitness_cache.setdefault(key, [None, None])
+        if action is not None:
+            entry[0] = action
+        if fitness is not None:
+            entry[1] = fitness
+        self._fitness_cache.move_to_end(key)
+        while len(self._fitness_cache) > config.FITNESS_CACHE_SIZE:
+            self._fitness_cache.popitem(last=False)
+
+    def register_fitness(self, individual: prompt, fitness: float):
+        """
+        Remember the fitness of an individual for the last sampled observation.
+        """
+        self._cache_set(
+            self._cache_key(individual, self._last_observation), fitness=fitness
+        )
+
+    def get_fitness(self, individual: prompt) -> typing.Optional[float]:
+        """
+        Return the remembered fitness of an individual for the last sampled observation, or None if it was not evaluated yet.
+        """
+        entry = self._cache_get(self._cache_key(individual, self._last_observation))
+        return None if entry is None else entry[1]
+
     def evolve(self, fitnesses):
         """
         Update the population based on the fitness scores.
         """
+        for ind, fit in zip(self.individuals, fitnesses):
+            self.register_fitness(ind, fit)
         self._selection(fitnesses)
 
     def sample(self, observation):
         """
         Sample actions from all the individuals.
+        Each distinct individual is only sampled once per observation, repeated individuals and previously sampled (individual, observation) pairs reuse the cached action.
         """
-        actions = []
-        for ind in self.individuals:
-            try:
-                actions.append(self.sampler(system_prompt=ind, context=observation))
-            except Exception as e:
-                logger.warning(f"Failed to sample {ind}: {e}")
-        return actions
+        self._last_observation = observation
+        actions_by_ind = {}
+        to_sample = []
+        for ind in dict.fromkeys(self.individuals):  # unique, in population order
+            entry = self._cache_get(self._cache_key(ind, observation))
+            if entry is not None and entry[0] is not None:
+                actions_by_ind[ind] = entry[0]
+            else:
+                to_sample.append(ind)
+        if to_sample:
+            workers = min(len(to_sample), self.max_concurrency)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(self._sample, ind, observation)
+                    for ind in to_sample
+                ]
+            for ind, future in zip(to_sample, futures):
+                try:
+                    actions_by_ind[ind] = future.result()
+                    self._cache_set(
+                        self._cache_key(ind, observation), action=actions_by_ind[ind]
+                    )
+                except Exception as e:
+                    logger.warning(f"Failed to sample {ind}: {e}")
+        # keep population order
+        return [
+            actions_by_ind[ind] for ind in self.individuals if ind in actions_by_ind
+        ]
 
 
 class LLMPopulation:
@@ -10,6 +10,7 @@ def get_lmu_openai_client():
     assert USERNAME is not None, "API_USERNAME is not set in .env or file not found."
     assert PASSWORD is not None, "API_PASSWORD is not set in .env or file not found."
     openai.OpenAI.custom_auth = httpx.BasicAuth(USERNAME, PASSWORD)
+    openai.AsyncOpenAI.custom_auth = httpx.BasicAuth(USERNAME, PASSWORD)
     client = openai.OpenAI(
         base_url="https://ollama.mobile.ifi.lmu.de/v1/", api_key="none"
     )
@@ -2,18 +2,30 @@
 This modules contains the functions to apply a patch to a codebase and run tests on it.
 """
 
-import time
+import atexit
+import concurrent.futures
+import contextlib
 import docker
 import tempfile
 import logging
 import docker.errors
+import docker.models.containers
+import hashlib
+import io
+import queue
+import shlex
 import sys
 import stat
+import tarfile
 import os
 import shutil
 import subprocess
+import threading
+import typing
+import uuid
 import xml.etree.ElementTree as ET
 
+from . import cache
 from . import config
 
 logger = logging.getLogger("dockerconnector")
@@ -23,6 +35,20 @@ class MalformedPatchException(Exception):
     pass
 
 
+class TestTimeoutException(Exception):
+    """Exception raised when the tests do not finish within TEST_TIMEOUT_SECONDS seconds"""
+
+
+class MissingTestResultsException(Exception):
+    """Exception raised when pytest does not write readable test results, e.g. because collection failed"""
+
+
+# generate_patch temporarily modifies the working tree of the codebase, serialize access to it between sampler threads
+_codebase_lock = threading.Lock()
+# files generate_patch edited while a CodeExecutor was copying the codebase, by id of the CodeExecutor
+_edited_during_copy: typing.Dict[int, typing.Set[str]] = {}
+
+
 class DockerConnector:
     """
     DockerConnector is a singleton class that connects to the Docker daemon and builds the Docker image if it does not exist.
@@ -35,26 +61,56 @@ class DockerConnector:
             print("Docker is not running")
             logger.critical("Docker is not running")
             sys.exit(1)
+        self.image = None
         self.build_image_if_not_exists()
+        self.validators = {}
+        self._validators_lock = threading.Lock()
 
     def build_image_if_not_exists(self, tag=config.DOCKER_TAG):
+        if self.image is not None:  # only query the daemon once
+            return self.image
         try:
             logger.info("Getting docker image")
             image = self.client.images.get(tag)
         except docker.errors.ImageNotFound:
             logger.info("Image not found, building new image")
-            image = self.client.images.build(path=".", tag=config.DOCKER_TAG)
+            image, _ = self.client.images.build(path=".", tag=config.DOCKER_TAG)
         except Exception as e:
             logger.critical("Docker is not running", e)
             sys.exit(1)
+        self.image = image
         return image
 
+    def get_validator(self, code_base_root: str) -> "Container":
+        """
+        Get a long-lived container with the codebase mounted read-only, used to check patches without copying the codebase.
+        Only the validator of the latest codebase is kept, the validators of other codebases are torn down.
+        """
+        key = os.path.abspath(code_base_root)
+        with self._validators_lock:
+            if key not in self.validators:
+                self._destroy_validators()
+                self.validators[key] = Container(mount_dir=key, read_only=True)
+            return self.validators[key]
+
+    def destroy_validators(self):
+        with self._validators_lock:
+            self._destroy_validators()
+
+    def _destroy_validators(self):
+        for validator in self.validators.values():
+            validator.destroy()
+        self.validators.clear()
+
     instance = None
+    _instance_lock = threading.Lock()
 
     @staticmethod
     def get_instance():
         if DockerConnector.instance is None:
-            DockerConnector.instance = DockerConnector()
+            with DockerConnector._instance_lock:  # pool threads start concurrently
+                if DockerConnector.instance is None:
+                    DockerConnector.instance = DockerConnector()
         return DockerConnector.instance
 
 
@@ -63,42 +119,161 @@ class Container:
     Container is a wrapper around a Docker container. It is used to run commands in the container and cleans up after itself.
     """
 
-    def __init__(self, mount_dir: str):
+    def __init__(
+        self, mount_dir: str, read_only: bool = False, results_dir: str = None
+    ):
+        """
+        Start a container with `mount_dir` mounted at /repo.
+
+        Args:
+            mount_dir (str): The directory to mount.
+            read_only (bool): Mount the directory read-only.
+            results_dir (str): If given, `mount_dir` is mounted read-only at /repo-src instead and /repo is an in-memory tmpfs, so the codebase can be copied there and tests do not write to disk. `results_dir` is mounted at /results to get files, like the test results, out of the container.
+        """
         self.mount_dir = os.path.abspath(mount_dir)
-        self.container = DockerConnector.get_instance().client.containers.run(
-            image=config.DOCKER_TAG,
+        self.mode = "ro" if read_only else "rw"
+        volumes = {self.mount_dir: {"bind": "/repo", "mode": self.mode}}
+        tmpfs = None
+        if results_dir is not None:
+            volumes = {
+                self.mount_dir: {"bind": "/repo-src", "mode": "ro"},
+                os.path.abspath(results_dir): {"bind": "/results", "mode": "rw"},
+            }
+            tmpfs = {"/repo": config.TMPFS_OPTIONS}
+        connector = DockerConnector.get_instance()
+        self.container = connector.client.containers.run(
+            image=connector.image.id,
             detach=True,
-            volumes={self.mount_dir: {"bind": "/repo", "mode": "rw"}},
+            volumes=volumes,
+            tmpfs=tmpfs,
+            environment=config.CONTAINER_ENVIRONMENT,
             working_dir="/repo",
             tty=True,
-            name=f"se_gym_container_{time.time()}",
+            name=f"se_gym_container_{uuid.uuid4().hex}",
         )
+        self.timed_out = False
 
-    def run_command(self, command: str):
+    def run_command(self, command: str, timeout: float = None):
+        """
+        Run a command in the container. If it takes longer than `timeout` seconds, the container is killed.
+        """
         logger.debug(f"Running command {command}")
-        return self.container.exec_run(cmd=command, stdout=True, stderr=True)
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, self._kill)
+            timer.start()
+        try:
+            return self.container.exec_run(cmd=command, stdout=True, stderr=True)
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def run_with_stdin(
+        self, command: str, stdin: bytes
+    ) -> docker.models.containers.ExecResult:
+        """
+        Run a command in the container with `stdin` as its standard input.
+        The input is copied into the container with `put_archive` instead of being written to the exec socket, which works with every transport to the Docker daemon (unix socket, TCP, TLS, ssh, npipe).
+        """
+        logger.debug(f"Running command {command} with {len(stdin)} bytes of input")
+        name = f"se_gym_stdin_{uuid.uuid4().hex}"
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            info = tarfile.TarInfo(name)
+            info.size = len(stdin)
+            tar.addfile(info, io.BytesIO(stdin))
+        self.container.put_archive("/tmp", archive.getvalue())
+        return self.container.exec_run(
+            cmd=[
+                "sh",
+                "-c",
+                f"{command} < /tmp/{name}; code=$?; rm -f /tmp/{name}; exit $code",
+            ],
+            stdout=True,
+            stderr=True,
+        )
+
+    def _kill(self):
+        logger.warning(f"Command timed out, killing container {self.container.name}")
+        self.timed_out = True
+        try:
+            self.container.kill()
+        except docker.errors.APIError as e:
+            logger.warning(f"Failed to kill container {e}")
 
     def destroy(self):
         self.container.stop()
-        self.container.remove(
-            v={self.mount_dir: {"bind": "/repo", "mode": "rw"}}, force=True
-        )
+        self.container.remove(v=True, force=True)
 
 
 class CodeExecutor:
     """
-    CodeExecutor is a wrapper around a Docker container. It copies the codebase for the container, and cleans up after itself.
+    CodeExecutor is a wrapper around a Docker container. It copies the codebase into an in-memory directory of the container, and cleans up after itself.
     """
 
-    def __init__(self, code_base_root: str, patch: str):
+    def __init__(self, code_base_root: str, patch: str = None):
         self.code_base_root = code_base_root
         self.patch = patch
-        self.temp_dir = tempfile.mkdtemp(prefix="se_gym_")
+        self.temp_dir = tempfile.mkdtemp(prefix="se_gym_")  # only holds the results
         logger.debug(f"Created temporary directory {self.temp_dir}")
-        shutil.copytree(src=code_base_root, dst=f"{self.temp_dir}/", dirs_exist_ok=True)
-        with open(f"{self.temp_dir}/file.patch", "w") as file:
-            file.write(patch)
-        self.container = Container(mount_dir=self.temp_dir)  # start a container
+        self.container = Container(  # start a container
+            mount_dir=code_base_root, results_dir=self.temp_dir
+        )
+        # copy without the codebase lock, so sampler threads can keep generating patches meanwhile
+        with _codebase_lock:
+            edited = _edited_during_copy[id(self)] = set()
+        try:
+            copy_log = self.container.run_command(config.COPY_CODEBASE)
+        finally:
+            with _codebase_lock:
+                del _edited_during_copy[id(self)]
+        if copy_log.exit_code == 0 and edited:
+            # the copy may have caught these files mid-edit, generate_patch has restored them by now
+            with _codebase_lock:
+                copy_log = self.container.run_command(
+                    f"{config.COPY_FILES} {' '.join(map(shlex.quote, edited))}"
+                )
+        if copy_log.exit_code != 0:
+            outp = copy_log.output.decode("utf-8")
+            self.destroy()
+            logger.error(f"Failed to copy codebase {outp}")
+            raise RuntimeError("Failed to copy codebase", outp)
+
+    def apply(self, patch: str) -> docker.models.containers.ExecResult:
+        """
+        Apply the patch to the copied codebase. The patch is passed to `git apply` on its standard input instead of being written into the codebase.
+        """
+        self.patch = patch
+        return self.container.run_with_stdin(config.GIT_APPLY_PATCH, patch.encode())
+
+    def snapshot(self):
+        """
+        Commit the current state of the copied codebase, so that `reset` can restore it later.
+        """
+        snapshot_log = self.container.run_command(config.GIT_SNAPSHOT)
+        if snapshot_log.exit_code != 0:
+            outp = snapshot_log.output.decode("utf-8")
+            logger.error(f"Failed to snapshot codebase {outp}")
+            raise RuntimeError("Failed to snapshot codebase", outp)
+
+    def reset(self) -> bool:
+        """
+        Restore the copied codebase to the last snapshot, discarding applied patches and test artifacts.
+
+        Returns:
+            bool: Whether the codebase could be restored.
+        """
+        for name in os.listdir(self.temp_dir):  # drop the previous results
+            os.remove(os.path.join(self.temp_dir, name))
+        try:
+            reset_log = self.container.run_command(config.GIT_RESET_SNAPSHOT)
+        except docker.errors.APIError as e:
+            logger.warning(f"Failed to reset container {e}")
+            return False
+        if reset_log.exit_code != 0:
+            logger.warning(f"Failed to reset container {reset_log.output}")
+            return False
+        return True
 
     def destroy(self):
         """
@@ -114,6 +289,192 @@ class CodeExecutor:
         os.unlink(path)
 
 
+def codebase_fingerprint(code_base_root: str) -> str:
+    """
+    Identify the state of a git codebase by its HEAD commit, the diff of the working tree against it and the content of the untracked files.
+    """
+    fingerprint = hashlib.sha1()
+    with _codebase_lock:
+        for command in (config.GIT_HEAD, config.GIT_DIFF_HEAD):
+            fingerprint.update(
+                subprocess.run(command, cwd=code_base_root, capture_output=True).stdout
+            )
+        untracked = subprocess.run(
+            config.GIT_UNTRACKED, cwd=code_base_root, capture_output=True
+        ).stdout
+        for name in untracked.split(b"\0"):
+            file_path = os.path.join(code_base_root, os.fsdecode(name))
+            if not name or not os.path.isfile(file_path):
+                continue
+            fingerprint.update(b"\0" + name + b"\0")
+            with open(file_path, "rb") as file:
+                fingerprint.update(file.read())
+    return fingerprint.hexdigest()
+
+
+class ContainerPool:
+    """
+    ContainerPool keeps up to `size` pre-warmed CodeExecutors for one codebase and hands them out for running patches.
+    After every job the copied codebase is reset to its snapshot, so neither the container start nor the copy of the codebase is paid per patch.
+    """
+
+    def __init__(
+        self,
+        code_base_root: str,
+        size: int = config.CONTAINER_POOL_SIZE,
+        fingerprint: typing.Optional[str] = None,
+    ):
+        self.code_base_root = code_base_root
+        self.fingerprint = fingerprint or codebase_fingerprint(code_base_root)
+        self.size = size
+        self.idle = queue.Queue()
+        self.executors = []
+        self.num_created = 0
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def acquire(self) -> CodeExecutor:
+        """
+        Get an idle CodeExecutor, start a new one if the pool is not full yet, or wait for one to be released.
+        """
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        if self._reserve():
+            return self._start_executor()
+        while True:
+            try:
+                return self.idle.get(timeout=1)
+            except queue.Empty:
+                pass
+            if self.closed:
+                raise RuntimeError("Container pool was destroyed")
+            if self._reserve():  # a broken executor was removed from the pool
+                return self._start_executor()
+
+    def warm_up(self):
+        """
+        Start all missing CodeExecutors in background threads and return immediately.
+        This way, the containers are started while the patches are still being generated.
+        """
+        while self._reserve():
+            threading.Thread(target=self._start_idle_executor, daemon=True).start()
+
+    def _reserve(self) -> bool:
+        with self._lock:
+            if self.closed or self.num_created >= self.size:
+                return False
+            self.num_created += 1
+            return True
+
+    def _start_executor(self) -> CodeExecutor:
+        try:
+            executor = CodeExecutor(self.code_base_root)
+            executor.snapshot()
+        except Exception:
+            with self._lock:
+                self.num_created -= 1
+            raise
+        with self._lock:
+            self.executors.append(executor)
+        return executor
+
+    def _start_idle_executor(self):
+        try:
+            executor = self._start_executor()
+        except Exception as e:
+            logger.warning(f"Failed to start container {e}")
+            return
+        if self.closed:
+            self.release(executor)  # tears it down
+        else:
+            self.idle.put(executor)
+
+    def release(self, executor: CodeExecutor):
+        """
+        Reset the codebase of the CodeExecutor and return it to the pool. Broken executors are replaced.
+        """
+        if not self.closed and executor.reset():
+            self.idle.put(executor)
+            return
+        with self._lock:
+            self.executors.remove(executor)
+            self.num_created -= 1
+        executor.destroy()
+
+    @contextlib.contextmanager
+    def lease(self):
+        executor = self.acquire()
+        try:
+            yield executor
+        finally:
+            self.release(executor)
+
+    def destroy(self):
+        """
+        Tear down all idle CodeExecutors. Leased ones are torn down on release.
+        """
+        self.closed = True
+        while True:
+            try:
+                executor = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self.executors.remove(executor)
+                self.num_created -= 1
+            executor.destroy()
+
+    pools = {}
+    _pools_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance(
+        code_base_root: str, fingerprint: typing.Optional[str] = None
+    ) -> "ContainerPool":
+        """
+        Get the pool for a codebase. The pool is recreated if the codebase changed (new HEAD, modified or untracked files).
+        Only the pool of the latest codebase is kept, switching to another codebase tears down the pools of the others.
+
+        Args:
+            code_base_root (str): The root directory of the codebase.
+            fingerprint (str): The `codebase_fingerprint` of the codebase, if it is already known.
+        """
+        key = os.path.abspath(code_base_root)
+        fingerprint = fingerprint or codebase_fingerprint(code_base_root)
+        with ContainerPool._pools_lock:
+            pool = ContainerPool.pools.get(key)
+            if pool is not None and pool.fingerprint != fingerprint:
+                logger.debug(f"Codebase {key} changed, recreating container pool")
+                ContainerPool.pools.pop(key).destroy()
+                pool = None
+            if pool is None:
+                for other_key, other_pool in ContainerPool.pools.items():
+                    logger.debug(f"Switched from codebase {other_key} to {key}")
+                    other_pool.destroy()
+                ContainerPool.pools.clear()
+                pool = ContainerPool(code_base_root, fingerprint=fingerprint)
+                ContainerPool.pools[key] = pool
+        return pool
+
+    @staticmethod
+    def destroy_all():
+        with ContainerPool._pools_lock:
+            for pool in ContainerPool.pools.values():
+                pool.destroy()
+            ContainerPool.pools.clear()
+
+
+atexit.register(ContainerPool.destroy_all)
+
+
+@atexit.register
+def _destroy_validators():
+    if DockerConnector.instance is not None:
+        DockerConnector.instance.destroy_validators()
+
+
 def check_patch(code_base_root: str, patch: str):
     """
     Check if a patch can be applied to a codebase. The codebase will not be modified.
@@ -122,18 +483,36 @@ def check_patch(code_base_root: str, patch: str):
         code_base_root (str): The root directory of the codebase.
         patch (str): The patch to apply to the codebase. This file might be corrupted, in which case the function will raise an MalformedPatchException.
     """
-    with open(f"{code_base_root}/file.patch", "w") as file:
-        file.write(patch)
-    rand_path = f"./temp{str(time.time())}_file.patch"
-    with open(rand_path, "w") as file:
-        file.write(patch)
-        logger.debug(f"writing patch to file {rand_path}")
-    res = subprocess.check_output(args=config.GIT_CHECK_PATCH, cwd=code_base_root)
+    with _codebase_lock:
+        res = subprocess.run(
+            args=shlex.split(config.GIT_CHECK_PATCH),
+            cwd=code_base_root,
+            input=patch.encode(),
+            capture_output=True,
+        )
     if res.returncode != 0:
+        outp = res.stderr.decode("utf-8")
         logger.info(
-            f"Failed to apply patch STDOUT:{res.stdout} STDERR:{res.stderr} PATCH:{patch}"
+            f"Failed to apply patch STDOUT:{res.stdout} STDERR:{outp} PATCH:{patch}"
         )
-        raise MalformedPatchException("Failed to apply patch", res.stdout)
+        raise MalformedPatchException("Failed to apply patch", outp)
+
+
+def check_patch_docker(code_base_root: str, patch: str):
+    """
+    Check if a patch can be applied to a codebase, using the read-only validator container of the codebase. The codebase will not be modified.
+
+    Args:
+        code_base_root (str): The root directory of the codebase.
+        patch (str): The patch to apply to the codebase. This file might be corrupted, in which case the function will raise an MalformedPatchException.
+    """
+    validator = DockerConnector.get_instance().get_validator(code_base_root)
+    with _codebase_lock:
+        check_log = validator.run_with_stdin(config.GIT_CHECK_PATCH, patch.encode())
+    if check_log.exit_code != 0:
+        outp = check_log.output.decode("utf-8")
+        logger.info(f"Failed to apply patch {outp}")
+        raise MalformedPatchException("Failed to apply patch", outp)
 
 
 def generate_patch(
@@ -142,28 +521,33 @@ def generate_patch(
     """
     Generate a patch file from the old and new code.
     """
-    # discard current git changes in the codebase
-    subprocess.run(config.GIT_DISCARD_CHANGES, cwd=code_base_root)
-    # find the file to change
-    file_path = os.path.join(code_base_root, filename)
-    if not os.path.exists(file_path):
-        logger.info(f"File {file_path} not found")
-        raise ValueError(f"File {file_path} not found")
-    # find the old code in the file
-    with open(file_path, "r") as file:
-        file_content = file.read()
-    if old_code not in file_content:
-        logger.info(f"Old code not found in the file {file_path}")
-        raise ValueError(f"Old code not found in the {file_path}")
-    # replace the old code with the new code
-    new_file_content = file_content.replace(old_code, new_code)
-    with open(file_path, "w") as file:
-        file.write(new_file_content)
-    # create a patch file running git diff
-    patch = subprocess.run(config.GIT_DIFF, cwd=code_base_root, stdout=subprocess.PIPE)
-    # discard the changes
-    subprocess.run(config.GIT_DISCARD_CHANGES, cwd=code_base_root)
-    return patch.stdout.decode("utf-8")
+    with _codebase_lock:
+        # discard current git changes in the codebase
+        subprocess.run(config.GIT_DISCARD_CHANGES, cwd=code_base_root)
+        # find the file to change
+        file_path = os.path.join(code_base_root, filename)
+        if not os.path.exists(file_path):
+            logger.info(f"File {file_path} not found")
+            raise ValueError(f"File {file_path} not found")
+        # find the old code in the file
+        with open(file_path, "r") as file:
+            file_content = file.read()
+        if old_code not in file_content:
+            logger.info(f"Old code not found in the file {file_path}")
+            raise ValueError(f"Old code not found in the {file_path}")
+        # replace the old code with the new code
+        new_file_content = file_content.replace(old_code, new_code)
+        for edited in _edited_during_copy.values():
+            edited.add(filename)
+        with open(file_path, "w") as file:
+            file.write(new_file_content)
+        # create a patch file running git diff
+        patch = subprocess.run(
+            config.GIT_DIFF, cwd=code_base_root, stdout=subprocess.PIPE
+        )
+        # discard the changes
+        subprocess.run(config.GIT_DISCARD_CHANGES, cwd=code_base_root)
+        return patch.stdout.decode("utf-8")
 
 
 def apply_patch(code_base_root: str, patch: str):
@@ -171,12 +555,12 @@ def apply_patch(code_base_root: str, patch: str):
     Apply a patch to a codebase.
 
     Args:
-        code_base_root (str): The root directory of the codebase. The directory will be copied and the patch will be applied to the copy. The original codebase will not be modified. The codebase should be a git repository.
+        code_base_root (str): The root directory of the codebase. The directory will be copied into every pooled container and the patch will be applied to the copy. The original codebase will not be modified. The codebase should be a git repository.
         patch (str): The patch to apply to the codebase. This file might be corrupted, in which case the function will raise an MalformedPatchException.
     """
-    executor = CodeExecutor(code_base_root, patch)
-    apply_log = executor.container.run_command(config.GIT_APPLY_PATCH)  # Try to patch
-    executor.destroy()
+    check_patch_docker(code_base_root, patch)  # cheap pre-flight check
+    with ContainerPool.get_instance(code_base_root).lease() as executor:
+        apply_log = executor.apply(patch)
     # Check if the patch was applied successfully
     if apply_log.exit_code != 0:
         outp = apply_log.output.decode("utf-8")
@@ -185,8 +569,39 @@ def apply_patch(code_base_root: str, patch: str):
     logger.info("Patch applied successfully")
 
 
+def pytest_command(
+    command: str = config.PYTEST_COMMAND,
+    fast_fail: bool = False,
+    failed_first: bool = True,
+    num_workers: typing.Optional[str] = None,
+) -> str:
+    """
+    Append the optional pytest flags to a pytest command.
+
+    Args:
+        command (str): The pytest command.
+        fast_fail (bool): Stop after the first failing test (`-x`). Only use this if the fitness does not count failed tests.
+        failed_first (bool): Run the tests that failed in the previous run of the container first (`--ff`).
+        num_workers (str): Run the tests in parallel with pytest-xdist (`-n`), e.g. "auto". The image needs pytest-xdist installed.
+    """
+    if fast_fail:
+        command += " -x"
+    if failed_first:
+        # keep the cache outside of /repo, so it survives resetting the codebase
+        command += f" --ff -o cache_dir={config.PYTEST_CACHE_DIR}"
+    if num_workers is not None:
+        command += f" -n {num_workers}"
+    return command
+
+
 def apply_patch_and_test(
-    code_base_root: str, patch: str, command: str = "pytest --junitxml=testresults.xml"
+    code_base_root: str,
+    patch: str,
+    command: str = config.PYTEST_COMMAND,
+    fast_fail: bool = False,
+    failed_first: bool = True,
+    num_workers: typing.Optional[str] = None,
+    fingerprint: typing.Optional[str] = None,
 ) -> ET.Element:
     """
     Apply a patch to a codebase and run tests on it.
@@ -194,26 +609,111 @@ def apply_patch_and_test(
     Args:
         code_base_root (str): The root directory of the codebase.
         patch (str): The patch to apply to the codebase. This file should be a valid patch.
-        command (str): The command to run in the container. Defaults to "pytest".
+        command (str): The pytest command to run in the container. It has to write the results to /results/testresults.xml.
+        fast_fail, failed_first, num_workers: Optional pytest flags appended to the command, see `pytest_command`.
+        fingerprint (str): The `codebase_fingerprint` of the codebase, if it is already known.
 
     Returns:
         ET.Element: The XML tree of the test results.
     """
-
-    executor = CodeExecutor(code_base_root, patch)
-    apply_log = executor.container.run_command(config.GIT_APPLY_PATCH)  # Try to patch
-    if apply_log.exit_code != 0:  # this shouldn't be happening
-        outp = apply_log.output.decode("utf-8")
-        logger.error("Failed to apply patch", outp)
-        raise MalformedPatchException("Failed to apply patch", outp)
-    test_log = executor.container.run_command(command)  # Run the tests
-    test_xml = executor.container.run_command("cat testresults.xml")
-    executor.destroy()
-    xml_str = test_xml.output.decode("utf-8")
-    tree = ET.fromstring(xml_str)
+    fingerprint = fingerprint or codebase_fingerprint(code_base_root)
+    if config.CACHE_TEST_RESULTS:  # skip docker for patches that were already tested
+        cache_key = cache.ResultCache.make_key(
+            fingerprint, patch, command, str(fast_fail)
+        )
+        cached = cache.ResultCache.get_instance().get(cache_key)
+        if cached is not None:
+            logger.debug("Using cached test results")
+            return ET.fromstring(cached)
+    check_patch_docker(code_base_root, patch)  # cheap pre-flight check
+    pool = ContainerPool.get_instance(code_base_root, fingerprint)
+    with pool.lease() as executor:
+        apply_log = executor.apply(patch)
+        if apply_log.exit_code != 0:  # this shouldn't be happening
+            outp = apply_log.output.decode("utf-8")
+            logger.error("Failed to apply patch", outp)
+            raise MalformedPatchException("Failed to apply patch", outp)
+        test_log = executor.container.run_command(  # Run the tests
+            pytest_command(command, fast_fail, failed_first, num_workers),
+            timeout=config.TEST_TIMEOUT_SECONDS,
+        )
+        if executor.container.timed_out:
+            raise TestTimeoutException(
+                f"Tests did not finish within {config.TEST_TIMEOUT_SECONDS} seconds"
+            )
+        outp = test_log.output.decode("utf-8")
+        logger.debug(f"Test output {outp}")
+        # /results is bind-mounted from temp_dir, read the results from the host
+        try:
+            tree = ET.parse(os.path.join(executor.temp_dir, "testresults.xml"))
+        except (OSError, ET.ParseError) as e:
+            logger.info(f"Failed to read test results {e}")
+            raise MissingTestResultsException("Failed to read test results", outp)
+        tree = tree.getroot()
+    if config.CACHE_TEST_RESULTS:
+        cache.ResultCache.get_instance().set(
+            cache_key, ET.tostring(tree, encoding="unicode")
+        )
     return tree
 
 
+def evaluate_population(
+    code_base_root: str,
+    patches: typing.List[str],
+    command: str = config.PYTEST_COMMAND,
+    fast_fail: bool = False,
+    failed_first: bool = True,
+    num_workers: typing.Optional[str] = None,
+) -> typing.List[typing.Optional[ET.Element]]:
+    """
+    Apply every patch to its own copy of the codebase and run the tests, in parallel on the container pool.
+
+    Args:
+        code_base_root (str): The root directory of the codebase.
+        patches (List[str]): The patches to evaluate. These should be valid patches.
+        command (str): The pytest command to run in the container. It has to write the results to /results/testresults.xml.
+        fast_fail, failed_first, num_workers: Optional pytest flags appended to the command, see `pytest_command`.
+
+    Returns:
+        List[Optional[ET.Element]]: The XML trees of the test results, in the same order as the patches. Duplicate patches share the same tree. Patches that could not be applied, whose tests timed out or did not write test results get None, the other patches are still evaluated.
+    """
+    unique_patches = list(dict.fromkeys(patches))  # identical patches are tested once
+    fingerprint = codebase_fingerprint(code_base_root)
+    pool_size = ContainerPool.get_instance(code_base_root, fingerprint).size
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, min(len(unique_patches), pool_size))
+    ) as executor:
+        futures = {
+            patch: executor.submit(
+                apply_patch_and_test,
+                code_base_root,
+                patch,
+                command,
+                fast_fail,
+                failed_first,
+                num_workers,
+                fingerprint,
+            )
+            for patch in unique_patches
+        }
+    trees = {}
+    for patch, future in futures.items():
+        try:
+            trees[patch] = future.result()
+        except (
+            MalformedPatchException,
+            TestTimeoutException,
+            MissingTestResultsException,
+        ) as e:
+            logger.warning(f"Failed to evaluate patch {e}")
+            trees[patch] = None
+    return [trees[patch] for patch in patches]
+
+
+# junit child tags of a testcase and the resulting status, in order of precedence
+_STATUS_TAGS = {"failure": "failed", "error": "error", "skipped": "skipped"}
+
+
 def parse_pytest_xml(tree: ET.Element) -> dict:
     """
     Parse the XML tree of a pytest test result.
@@ -226,17 +726,18 @@ def parse_pytest_xml(tree: ET.Element) -> dict:
     """
     test_results = {}
     for testcase in tree.iter("testcase"):
-        test_name = testcase.get("classname") + "." + testcase.get("name")
-        test_results[test_name] = {}
-        if testcase.find("failure") is not None:
-            test_results[test_name]["status"] = "failed"
-            test_results[test_name]["message"] = testcase.find("failure").text
-        elif testcase.find("error") is not None:
-            test_results[test_name]["status"] = "error"
-            test_results[test_name]["message"] = testcase.find("error").text
-        elif testcase.find("skipped") is not None:
-            test_results[test_name]["status"] = "skipped"
-            test_results[test_name]["message"] = testcase.find("skipped").text
+        test_name = f"{testcase.get('classname')}.{testcase.get('name')}"
+        # single pass over the children instead of one `find` per status, keeping the first child of each tag like `find`
+        found = {}
+        for child in testcase:
+            if child.tag in _STATUS_TAGS:
+                found.setdefault(child.tag, child)
+        tag = next((t for t in _STATUS_TAGS if t in found), None)
+        if tag is not None:
+            test_results[test_name] = {
+                "status": _STATUS_TAGS[tag],
+                "message": found[tag].text,
+            }
         else:
-            test_results[test_name]["status"] = "passed"
+            test_results[test_name] = {"status": "passed"}
     return test_results
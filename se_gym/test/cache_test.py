@@ -0,0 +1,16 @@
+import se_gym.cache
+
+
+def test_result_cache(tmp_path):
+    cache = se_gym.cache.ResultCache(str(tmp_path / "cache.sqlite3"))
+    key = cache.make_key("codebase", "patch")
+    assert key != cache.make_key("codebase", "other patch")
+    assert cache.get(key) is None
+    cache.set(key, "<testsuites />")
+    assert cache.get(key) == "<testsuites />"
+    # the results persist in the database
+    assert (
+        se_gym.cache.ResultCache(str(tmp_path / "cache.sqlite3")).get(key) is not None
+    )
+    cache.clear()
+    assert cache.get(key) is None
@@ -0,0 +1,132 @@
+import openai
+import re
+import types
+import se_gym.genetic
+
+
+class Sampler:
+    """
+    Return a fake patch for every individual and record the calls.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, system_prompt, context):
+        self.calls.append(system_prompt)
+        if system_prompt == "broken":
+            raise ValueError("No patch")
+        return f"patch of {system_prompt} for {context}"
+
+
+class Completions:
+    """
+    Answer crossover and mutation requests with numbered children and record the response models.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    async def create(self, model, messages, response_model, max_retries):
+        self.requests.append(response_model.__name__)
+        prompt = messages[-1]["content"]
+        if response_model is se_gym.genetic.Child:
+            parent = re.search(r"^=+\n(.*)\n=+$", prompt, re.M).group(1)
+            return se_gym.genetic.Child(child=f"mutated {parent}")
+        if response_model is se_gym.genetic.Children:
+            return se_gym.genetic.Children(child1="crossed", child2="crossed")
+        if response_model is se_gym.genetic.MutationBatch:
+            num = len(re.findall(r"^Parent \d+:", prompt, re.M))
+            return se_gym.genetic.MutationBatch(
+                children=[
+                    se_gym.genetic.Child(child=f"mutated {i}") for i in range(num)
+                ]
+            )
+        num = len(re.findall(r"^Pair \d+:", prompt, re.M))
+        return se_gym.genetic.CrossoverBatch(
+            pairs=[
+                se_gym.genetic.Children(child1=f"crossed {i}", child2="crossed")
+                for i in range(num)
+            ]
+        )
+
+
+def make_population(individuals, sampler=None, **kwargs):
+    return se_gym.genetic.Population(
+        client=openai.Client(api_key="test"),
+        initial_individuals=individuals,
+        sampler=sampler or Sampler(),
+        **kwargs,
+    )
+
+
+def test_sample_order():
+    sampler = Sampler()
+    population = make_population(["b", "a", "b", "broken", "a"], sampler)
+    actions = population.sample("obs")
+    # every distinct individual is sampled once, failed individuals are dropped
+    assert sorted(sampler.calls) == ["a", "b", "broken"]
+    assert actions == [
+        "patch of b for obs",
+        "patch of a for obs",
+        "patch of b for obs",
+        "patch of a for obs",
+    ]
+
+
+def test_sample_cache(monkeypatch):
+    sampler = Sampler()
+    population = make_population(["a", "b", "broken"], sampler)
+    population.sample("obs")
+    population.sample("obs")
+    # only the failed individual is sampled again
+    assert sorted(sampler.calls) == ["a", "b", "broken", "broken"]
+    population.sample("other obs")
+    assert len(sampler.calls) == 7
+    population.register_fitness("a", 0.5)
+    assert population.get_fitness("a") == 0.5
+    assert population.get_fitness("b") is None
+    # the least recently used entries are evicted
+    monkeypatch.setattr(se_gym.config, "FITNESS_CACHE_SIZE", 1)
+    population.sample("third obs")
+    assert len(population._fitness_cache) == 1
+
+
+def test_breed_batches(monkeypatch):
+    monkeypatch.setattr(se_gym.genetic.random, "random", lambda: 0.0)
+    population = make_population(
+        ["a", "b", "c", "d"], elite_size=1, mutation_rate=1, crossover_rate=1
+    )
+    completions = Completions()
+    population.client = types.SimpleNamespace(
+        chat=types.SimpleNamespace(completions=completions)
+    )
+    population.evolve([4, 3, 2, 1])
+    # one request each for the 3 mutations (the elite is skipped) and the 2 crossovers
+    assert sorted(completions.requests) == ["CrossoverBatch", "MutationBatch"]
+    assert population.individuals == [
+        "a",
+        "mutated 0",
+        "mutated 1",
+        "mutated 2",
+        "crossed 0",
+        "crossed 1",
+        "crossed",
+        "crossed",
+    ]
+
+
+def test_breed_batch_fallback(monkeypatch):
+    monkeypatch.setattr(se_gym.genetic.random, "random", lambda: 0.0)
+    # batches that do not fit into the context are split into one request per operation
+    monkeypatch.setattr(se_gym.config, "MAX_CONTEXT_TOKENS", 0)
+    population = make_population(
+        ["a", "b", "c", "d"], elite_size=1, mutation_rate=1, crossover_rate=1
+    )
+    completions = Completions()
+    population.client = types.SimpleNamespace(
+        chat=types.SimpleNamespace(completions=completions)
+    )
+    population.evolve([4, 3, 2, 1])
+    assert sorted(completions.requests) == ["Child"] * 3 + ["Children"] * 2
+    assert population.individuals[:4] == ["a", "mutated b", "mutated c", "mutated d"]
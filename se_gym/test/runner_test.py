@@ -1,6 +1,8 @@
 import se_gym
 import os
 import pytest
+import subprocess
+import types
 
 
 def download_dummy_repo():
@@ -16,6 +18,14 @@ def download_dummy_repo():
         open("./temp/dummy/src/python_env/__init__.py", "w").close()
 
 
+@pytest.fixture(autouse=True)
+def no_result_cache(monkeypatch):
+    """
+    Run the tests in docker instead of returning the cached results of a previous run.
+    """
+    monkeypatch.setattr(se_gym.config, "CACHE_TEST_RESULTS", False)
+
+
 APPLICABLE_PATCH = """\
 diff --git a/src/python_env/__main__.py b/src/python_env/__main__.py
 index 2b39a9f..652d973 100644
@@ -68,3 +78,98 @@ def test_apply_patch_and_test_invalid():
     tree = se_gym.apply_patch_and_test("./temp/dummy", INVALID_TEST_PATH)
     res = se_gym.runner.parse_pytest_xml(tree)
     assert res["tests.my_test.test_main"]["status"] == "failed"
+
+
+def test_parse_pytest_xml():
+    tree = se_gym.runner.ET.fromstring("""\
+<testsuites><testsuite name="pytest" tests="5">
+<testcase classname="tests.my_test" name="test_pass" />
+<testcase classname="tests.my_test" name="test_fail"><failure message="boom">boom</failure><error message="teardown">teardown</error></testcase>
+<testcase classname="tests.my_test" name="test_error"><error message="err">err</error></testcase>
+<testcase classname="tests.my_test" name="test_skip"><skipped message="skip">skip</skipped></testcase>
+<testcase classname="tests.my_test" name="test_errors"><error message="setup">setup err</error><error message="teardown">teardown err</error></testcase>
+</testsuite></testsuites>""")
+    res = se_gym.runner.parse_pytest_xml(tree)
+    assert res["tests.my_test.test_pass"] == {"status": "passed"}
+    assert res["tests.my_test.test_fail"] == {"status": "failed", "message": "boom"}
+    assert res["tests.my_test.test_error"] == {"status": "error", "message": "err"}
+    assert res["tests.my_test.test_skip"] == {"status": "skipped", "message": "skip"}
+    # the first error wins, like with `find`
+    assert res["tests.my_test.test_errors"] == {
+        "status": "error",
+        "message": "setup err",
+    }
+
+
+def test_codebase_fingerprint(tmp_path):
+    def git(*args):
+        subprocess.run(["git", *args], cwd=tmp_path, check=True, capture_output=True)
+
+    git("init", "-q")
+    (tmp_path / "main.py").write_text("a = 1\n")
+    git("add", "-A")
+    git(
+        "-c",
+        "user.name=test",
+        "-c",
+        "user.email=test@localhost",
+        "commit",
+        "-qm",
+        "init",
+    )
+    fingerprints = [se_gym.runner.codebase_fingerprint(tmp_path)]
+    (tmp_path / "main.py").write_text("a = 2\n")
+    fingerprints.append(se_gym.runner.codebase_fingerprint(tmp_path))
+    # the file is already modified, `git status` would not change
+    (tmp_path / "main.py").write_text("a = 3\n")
+    fingerprints.append(se_gym.runner.codebase_fingerprint(tmp_path))
+    (tmp_path / "new.py").write_text("b = 1\n")
+    fingerprints.append(se_gym.runner.codebase_fingerprint(tmp_path))
+    (tmp_path / "new.py").write_text("b = 2\n")
+    fingerprints.append(se_gym.runner.codebase_fingerprint(tmp_path))
+    assert len(set(fingerprints)) == len(fingerprints)
+    assert se_gym.runner.codebase_fingerprint(tmp_path) == fingerprints[-1]
+
+
+def test_pytest_command():
+    assert se_gym.runner.pytest_command("pytest", failed_first=False) == "pytest"
+    assert (
+        se_gym.runner.pytest_command(
+            "pytest", fast_fail=True, failed_first=False, num_workers="auto"
+        )
+        == "pytest -x -n auto"
+    )
+    assert (
+        se_gym.runner.pytest_command("pytest")
+        == f"pytest --ff -o cache_dir={se_gym.config.PYTEST_CACHE_DIR}"
+    )
+
+
+def test_evaluate_population(monkeypatch):
+    calls = []
+
+    def apply_patch_and_test(code_base_root, patch, *args):
+        calls.append(patch)
+        if patch == "hanging patch":
+            raise se_gym.TestTimeoutException("Tests did not finish")
+        if patch == "breaking patch":
+            raise se_gym.MissingTestResultsException("No test results", "exit code 4")
+        return se_gym.runner.ET.Element("testsuites", name=patch)
+
+    monkeypatch.setattr(se_gym.runner, "apply_patch_and_test", apply_patch_and_test)
+    monkeypatch.setattr(se_gym.runner, "codebase_fingerprint", lambda root: "head")
+    monkeypatch.setattr(
+        se_gym.runner.ContainerPool,
+        "get_instance",
+        lambda root, fingerprint=None: types.SimpleNamespace(size=2),
+    )
+    trees = se_gym.evaluate_population(
+        "./temp/dummy",
+        ["patch 1", "patch 2", "patch 1", "hanging patch", "breaking patch"],
+    )
+    # identical patches are tested once and share the tree, a failing patch does not abort the others
+    assert sorted(calls) == ["breaking patch", "hanging patch", "patch 1", "patch 2"]
+    assert [tree.get("name") for tree in trees[:3]] == ["patch 1", "patch 2", "patch 1"]
+    assert trees[0] is trees[2]
+    assert trees[3] is None
+    assert trees[4] is None
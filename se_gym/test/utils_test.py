@@ -0,0 +1,36 @@
+import asyncio
+import se_gym.utils
+
+
+async def current_loop():
+    return asyncio.get_running_loop()
+
+
+def test_run_sync():
+    loop = se_gym.utils.run_sync(current_loop())
+    assert se_gym.utils.run_sync(current_loop()) is loop
+
+    async def nested():
+        # also works from inside a running event loop
+        return se_gym.utils.run_sync(current_loop())
+
+    assert asyncio.run(nested()) is loop
+
+
+def test_rate_limiter():
+    limiter = se_gym.utils.AsyncRateLimiter(2, 0.2)
+
+    async def acquire_times(amounts):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        times = []
+        for amount in amounts:
+            await limiter.acquire(amount)
+            times.append(loop.time() - start)
+        return times
+
+    times = se_gym.utils.run_sync(acquire_times([1, 1, 1, 1, 10]))
+    # two units per window, an oversized request takes the whole window
+    assert times[2] >= 0.2
+    assert times[3] >= 0.2
+    assert times[4] >= 0.4
@@ -1,3 +1,8 @@
+import asyncio
+import collections
+import threading
+
+
 def slugify(value, allow_unicode=False):
     """
     Taken from Django's https://github.com/django/django/blob/main/django/utils/text.py
@@ -20,3 +25,59 @@ def slugify(value, allow_unicode=False):
         )
     value = re.sub(r"[^\w\s-]", "", value.lower())
     return re.sub(r"[-\s]+", "-", value).strip("-_")
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="se_gym_event_loop", daemon=True
+            ).start()
+    return _loop
+
+
+def run_sync(coro):
+    """
+    Run a coroutine to completion from synchronous code and return its result.
+    The coroutine is executed on a single long-lived background event loop, so this also works from inside a running loop (e.g. Jupyter) and async clients can be reused between calls.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+class AsyncRateLimiter:
+    """
+    Allow at most `max_rate` units (e.g. requests or tokens) per `time_period` seconds, using a sliding window.
+    Must only be used from a single event loop.
+    """
+
+    def __init__(self, max_rate: float, time_period: float = 60):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._used = 0
+        self._window = collections.deque()  # (time, amount)
+        self._lock = None  # created on the event loop
+
+    async def acquire(self, amount: float = 1):
+        """
+        Wait until `amount` units are available and take them.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        amount = min(amount, self.max_rate)  # a single oversized request can still pass
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                now = loop.time()
+                while self._window and self._window[0][0] <= now - self.time_period:
+                    self._used -= self._window.popleft()[1]
+                if self._used + amount <= self.max_rate:
+                    break
+                await asyncio.sleep(self._window[0][0] + self.time_period - now)
+            self._window.append((now, amount))
+            self._used += amount